@@ -5,10 +5,16 @@ All information-returning commands require login
 """
 
 import os
+import asyncio
+import hmac
+import hashlib
 import logging
-from typing import Dict, Set
-from telegram import Update, BotCommand
+import sqlite3
+import sys
+from typing import Dict, Final, FrozenSet, Optional, Set, Tuple
+from telegram import Update, BotCommand, Message
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
@@ -27,43 +33,159 @@ logger = logging.getLogger(__name__)
 # Conversation states
 USERNAME, PASSWORD = range(2)
 
-# Store authenticated users (in production, use a database)
+# Store authenticated users (persisted to SQLite so logins survive restarts)
 authenticated_users: Set[int] = set()
+AUTH_DB_PATH = os.getenv('AUTH_DB_PATH', 'auth.db')
 
 # Valid credentials (in production, use secure database with hashed passwords)
-VALID_CREDENTIALS = {
+_PLAIN_CREDENTIALS = {
     "admin": "admin123",
     "user1": "pass123",
     "demo": "demo123"
 }
 
+# Usernames and passwords are hashed once at import; logins look up the
+# username digest and compare fixed-length password digests
+VALID_CREDENTIALS: Dict[bytes, bytes] = {
+    hashlib.sha256(u.encode()).digest(): hashlib.sha256(p.encode()).digest()
+    for u, p in _PLAIN_CREDENTIALS.items()
+}
+
+# Compared against when the username is unknown, so timing stays uniform
+_DUMMY_DIGEST = bytes(32)
+
+# Shared prefix for each /users row
+_USER_ROW_PREFIX: Final[str] = sys.intern("• User ID: ")
+
+# Pre-rendered command responses (only the counts are filled in per call)
+_START_LOGGED_IN: Final[str] = (
+    "🔓 You're already logged in!\n\n"
+    "Available commands:\n"
+    "/info - Get system information\n"
+    "/stats - View statistics\n"
+    "/users - List users\n"
+    "/data - Get data summary\n"
+    "/logout - Logout from bot"
+)
+
+_START_LOGGED_OUT: Final[str] = (
+    "👋 Welcome to the Authenticated Bot!\n\n"
+    "🔒 Please login to access commands.\n"
+    "Use /login to authenticate."
+)
+
+_LOGIN_SUCCESS: Final[str] = (
+    "✅ Login successful!\n\n"
+    "You now have access to all commands:\n\n"
+    "📊 Information Commands:\n"
+    "/info - Get system information\n"
+    "/stats - View statistics\n"
+    "/users - List users\n"
+    "/data - Get data summary\n\n"
+    "🔧 Other Commands:\n"
+    "/help - Show this help message\n"
+    "/logout - Logout from bot"
+)
+
+_HELP_AUTH: Final[str] = (
+    "📚 Available Commands:\n\n"
+    "📊 Information Commands:\n"
+    "/info - Get system information\n"
+    "/stats - View statistics\n"
+    "/users - List users\n"
+    "/data - Get data summary\n\n"
+    "🔧 Other Commands:\n"
+    "/help - Show this help message\n"
+    "/logout - Logout from bot"
+)
+
+_HELP_UNAUTH: Final[str] = (
+    "🔒 Authentication Required\n\n"
+    "Please /login first to access commands.\n\n"
+    "Available after login:\n"
+    "• System information\n"
+    "• Statistics\n"
+    "• User lists\n"
+    "• Data summaries"
+)
+
+_AUTH_REQUIRED: Final[str] = (
+    "🔒 Authentication Required\n\n"
+    "Please /login first to access this command."
+)
+
+_INFO_TMPL: Final[str] = (
+    "📊 System Information\n\n"
+    "• Bot Status: Online\n"
+    "• Version: 1.0.0\n"
+    "• Active Users: {n}\n"
+    "• Database: Connected\n"
+    "• Last Update: 2025-10-06"
+)
+
+_STATS_TMPL: Final[str] = (
+    "📈 Statistics\n\n"
+    "• Total Requests: 1,234\n"
+    "• Active Sessions: {n}\n"
+    "• Success Rate: 98.5%\n"
+    "• Avg Response Time: 45ms\n"
+    "• Uptime: 99.9%"
+)
+
+_DATA_SUMMARY: Final[str] = (
+    "💾 Data Summary\n\n"
+    "• Records: 5,678\n"
+    "• Storage Used: 234 MB\n"
+    "• Last Backup: 2h ago\n"
+    "• Data Integrity: ✅ Good\n"
+    "• Sync Status: ✅ Synced"
+)
+
 
 class AuthenticatedBot:
     """Telegram bot with authentication requirement"""
 
     def __init__(self):
-        self.authenticated_users = authenticated_users
+        # Restore logged-in users from the previous run, revoking any session
+        # whose username is no longer in VALID_CREDENTIALS
+        self._db = sqlite3.connect(AUTH_DB_PATH)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions(uid INTEGER PRIMARY KEY, uhash BLOB NOT NULL)"
+            )
+            rows = self._db.execute("SELECT uid, uhash FROM sessions").fetchall()
+            stale = [(uid,) for uid, uhash in rows if uhash not in VALID_CREDENTIALS]
+            self._db.executemany("DELETE FROM sessions WHERE uid = ?", stale)
+        authenticated_users.update(uid for uid, uhash in rows if uhash in VALID_CREDENTIALS)
+        if stale:
+            logger.info(f"Revoked {len(stale)} session(s) for removed credentials")
+
+        # Writes go to the mutable set; handlers read the frozen snapshot,
+        # which is rebuilt only on login/logout
+        self._auth_mutable: Set[int] = authenticated_users
+        self.authenticated_users: FrozenSet[int] = frozenset(self._auth_mutable)
+        # (count, rendered user list); reset to None on login/logout
+        self._users_cache: Optional[Tuple[int, str]] = None
+
+    def close(self) -> None:
+        """Close the session database"""
+        self._db.close()
+
+    def _get_users_view(self) -> Tuple[int, str]:
+        """Return the cached active-user count and rendered list"""
+        if self._users_cache is None:
+            user_list = "\n".join(_USER_ROW_PREFIX + str(uid) for uid in self._auth_mutable)
+            self._users_cache = (len(self._auth_mutable), user_list)
+        return self._users_cache
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command"""
         user_id = update.effective_user.id
 
         if user_id in self.authenticated_users:
-            await update.message.reply_text(
-                "🔓 You're already logged in!\n\n"
-                "Available commands:\n"
-                "/info - Get system information\n"
-                "/stats - View statistics\n"
-                "/users - List users\n"
-                "/data - Get data summary\n"
-                "/logout - Logout from bot"
-            )
+            await update.message.reply_text(_START_LOGGED_IN)
         else:
-            await update.message.reply_text(
-                "👋 Welcome to the Authenticated Bot!\n\n"
-                "🔒 Please login to access commands.\n"
-                "Use /login to authenticate."
-            )
+            await update.message.reply_text(_START_LOGGED_OUT)
 
     async def login_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Start login conversation"""
@@ -83,7 +205,8 @@ class AuthenticatedBot:
     async def receive_username(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Receive username and ask for password"""
         username = update.message.text.strip()
-        context.user_data['username'] = username
+        # Only the digest is kept, so no plaintext username lands in persistence
+        context.user_data['uhash'] = hashlib.sha256(username.encode()).digest()
 
         await update.message.reply_text(
             f"Username: {username}\n\n"
@@ -94,7 +217,7 @@ class AuthenticatedBot:
     async def receive_password(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Verify credentials and complete login"""
         password = update.message.text.strip()
-        username = context.user_data.get('username')
+        uhash = context.user_data.pop('uhash', None)
         user_id = update.effective_user.id
 
         # Delete password message for security
@@ -103,22 +226,22 @@ class AuthenticatedBot:
         except:
             pass
 
-        # Verify credentials
-        if username in VALID_CREDENTIALS and VALID_CREDENTIALS[username] == password:
-            self.authenticated_users.add(user_id)
-            await update.message.reply_text(
-                "✅ Login successful!\n\n"
-                "You now have access to all commands:\n\n"
-                "📊 Information Commands:\n"
-                "/info - Get system information\n"
-                "/stats - View statistics\n"
-                "/users - List users\n"
-                "/data - Get data summary\n\n"
-                "🔧 Other Commands:\n"
-                "/help - Show this help message\n"
-                "/logout - Logout from bot"
-            )
-            logger.info(f"User {user_id} ({username}) logged in successfully")
+        # Verify credentials (constant-time, even for unknown usernames)
+        candidate = hashlib.sha256(password.encode()).digest()
+        stored = VALID_CREDENTIALS.get(uhash)
+        ok = hmac.compare_digest(stored if stored is not None else _DUMMY_DIGEST, candidate)
+        if ok and stored is not None:
+            # Persist first so a failed write leaves memory untouched
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions(uid, uhash) VALUES (?, ?)",
+                    (user_id, uhash)
+                )
+            self._auth_mutable.add(user_id)
+            self.authenticated_users = frozenset(self._auth_mutable)
+            self._users_cache = None
+            await update.message.reply_text(_LOGIN_SUCCESS)
+            logger.info(f"User {user_id} logged in successfully")
         else:
             await update.message.reply_text(
                 "❌ Invalid credentials!\n\n"
@@ -138,7 +261,12 @@ class AuthenticatedBot:
         user_id = update.effective_user.id
 
         if user_id in self.authenticated_users:
-            self.authenticated_users.remove(user_id)
+            # Persist first so a failed write leaves memory untouched
+            with self._db:
+                self._db.execute("DELETE FROM sessions WHERE uid = ?", (user_id,))
+            self._auth_mutable.remove(user_id)
+            self.authenticated_users = frozenset(self._auth_mutable)
+            self._users_cache = None
             await update.message.reply_text(
                 "👋 Logged out successfully!\n"
                 "Use /login to login again."
@@ -152,95 +280,67 @@ class AuthenticatedBot:
         user_id = update.effective_user.id
 
         if user_id in self.authenticated_users:
-            await update.message.reply_text(
-                "📚 Available Commands:\n\n"
-                "📊 Information Commands:\n"
-                "/info - Get system information\n"
-                "/stats - View statistics\n"
-                "/users - List users\n"
-                "/data - Get data summary\n\n"
-                "🔧 Other Commands:\n"
-                "/help - Show this help message\n"
-                "/logout - Logout from bot"
-            )
+            await update.message.reply_text(_HELP_AUTH)
         else:
-            await update.message.reply_text(
-                "🔒 Authentication Required\n\n"
-                "Please /login first to access commands.\n\n"
-                "Available after login:\n"
-                "• System information\n"
-                "• Statistics\n"
-                "• User lists\n"
-                "• Data summaries"
-            )
+            await update.message.reply_text(_HELP_UNAUTH)
 
     # Protected information commands (require authentication)
 
-    def require_auth(func):
-        """Decorator to require authentication for commands"""
-        async def wrapper(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-            user_id = update.effective_user.id
-            if user_id not in self.authenticated_users:
-                await update.message.reply_text(
-                    "🔒 Authentication Required\n\n"
-                    "Please /login first to access this command."
-                )
-                return
-            return await func(self, update, context)
-        return wrapper
+    def _require(self, update: Update) -> bool:
+        """Check whether the sender is logged in"""
+        return update.effective_user.id in self.authenticated_users
 
-    @require_auth
     async def info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Get system information (protected)"""
-        await update.message.reply_text(
-            "📊 System Information\n\n"
-            "• Bot Status: Online\n"
-            "• Version: 1.0.0\n"
-            "• Active Users: " + str(len(self.authenticated_users)) + "\n"
-            "• Database: Connected\n"
-            "• Last Update: 2025-10-06"
-        )
+        if not self._require(update):
+            await update.message.reply_text(_AUTH_REQUIRED)
+            return
+        await update.message.reply_text(_INFO_TMPL.format(n=len(self.authenticated_users)))
 
-    @require_auth
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """View statistics (protected)"""
-        await update.message.reply_text(
-            "📈 Statistics\n\n"
-            "• Total Requests: 1,234\n"
-            "• Active Sessions: " + str(len(self.authenticated_users)) + "\n"
-            "• Success Rate: 98.5%\n"
-            "• Avg Response Time: 45ms\n"
-            "• Uptime: 99.9%"
-        )
+        if not self._require(update):
+            await update.message.reply_text(_AUTH_REQUIRED)
+            return
+        await update.message.reply_text(_STATS_TMPL.format(n=len(self.authenticated_users)))
 
-    @require_auth
     async def users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """List users (protected)"""
-        user_list = "\n".join([f"• User ID: {uid}" for uid in self.authenticated_users])
+        if not self._require(update):
+            await update.message.reply_text(_AUTH_REQUIRED)
+            return
+        count, user_list = self._get_users_view()
         await update.message.reply_text(
-            f"👥 Active Users ({len(self.authenticated_users)})\n\n"
+            f"👥 Active Users ({count})\n\n"
             f"{user_list if user_list else 'No active users'}"
         )
 
-    @require_auth
     async def data_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Get data summary (protected)"""
+        if not self._require(update):
+            await update.message.reply_text(_AUTH_REQUIRED)
+            return
+        await update.message.reply_text(_DATA_SUMMARY)
+
+    async def unauthorized_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle messages from non-authenticated users (gated by NotAuthenticatedFilter)"""
         await update.message.reply_text(
-            "💾 Data Summary\n\n"
-            "• Records: 5,678\n"
-            "• Storage Used: 234 MB\n"
-            "• Last Backup: 2h ago\n"
-            "• Data Integrity: ✅ Good\n"
-            "• Sync Status: ✅ Synced"
+            "🔒 Please /login first to use this bot."
         )
 
-    async def unauthorized_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle messages from non-authenticated users"""
-        user_id = update.effective_user.id
-        if user_id not in self.authenticated_users:
-            await update.message.reply_text(
-                "🔒 Please /login first to use this bot."
-            )
+
+class NotAuthenticatedFilter(filters.MessageFilter):
+    """Match messages whose sender is not logged in to the given bot"""
+
+    def __init__(self, bot: AuthenticatedBot):
+        super().__init__(name="NotAuthenticatedFilter")
+        self.bot = bot
+
+    def filter(self, message: Message) -> bool:
+        return (
+            message.from_user is not None
+            and message.from_user.id not in self.bot.authenticated_users
+        )
 
 
 def main() -> None:
@@ -253,60 +353,90 @@ def main() -> None:
         print("Please set it with: export TELEGRAM_BOT_TOKEN='your-token-here'\n")
         return
 
+    # Use uvloop's faster event loop when available (not supported on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     # Create bot instance
     bot = AuthenticatedBot()
 
-    # Create application
-    application = Application.builder().token(token).build()
+    # Create application, throttled to Telegram's global and per-chat send
+    # limits when the python-telegram-bot[rate-limiter] extra is installed
+    builder = Application.builder().token(token)
+    try:
+        builder.rate_limiter(AIORateLimiter())
+    except RuntimeError:
+        logger.warning("AIORateLimiter unavailable; sending without rate limiting")
+    application = builder.build()
+
+    # Plain text that isn't a command (shared by every text handler below)
+    text_not_cmd = filters.TEXT & ~filters.COMMAND
 
     # Login conversation handler
     login_handler = ConversationHandler(
         entry_points=[CommandHandler('login', bot.login_start)],
         states={
-            USERNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.receive_username)],
-            PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.receive_password)],
+            USERNAME: [MessageHandler(text_not_cmd, bot.receive_username)],
+            PASSWORD: [MessageHandler(text_not_cmd, bot.receive_password)],
         },
         fallbacks=[CommandHandler('cancel', bot.cancel_login)],
     )
 
+    # Single source of truth for command handlers and the bot menu:
+    # (command, menu description, handler); /login is served by login_handler
+    commands = [
+        ("start", "Start the bot", bot.start),
+        ("login", "Login to access commands", None),
+        ("help", "Show help message", bot.help_command),
+        ("info", "Get system information (requires login)", bot.info_command),
+        ("stats", "View statistics (requires login)", bot.stats_command),
+        ("users", "List users (requires login)", bot.users_command),
+        ("data", "Get data summary (requires login)", bot.data_command),
+        ("logout", "Logout from bot", bot.logout),
+    ]
+
     # Add handlers
-    application.add_handler(CommandHandler('start', bot.start))
     application.add_handler(login_handler)
-    application.add_handler(CommandHandler('logout', bot.logout))
-    application.add_handler(CommandHandler('help', bot.help_command))
+    for name, _, callback in commands:
+        if callback is not None:
+            application.add_handler(CommandHandler(name, callback))
 
-    # Protected information commands
-    application.add_handler(CommandHandler('info', bot.info_command))
-    application.add_handler(CommandHandler('stats', bot.stats_command))
-    application.add_handler(CommandHandler('users', bot.users_command))
-    application.add_handler(CommandHandler('data', bot.data_command))
-
-    # Handle unauthorized messages
+    # Handle unauthorized messages; logged-in users' chatter matches no handler
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
+        text_not_cmd & NotAuthenticatedFilter(bot),
         bot.unauthorized_command
     ))
 
     # Set bot commands for menu
     async def post_init(app: Application) -> None:
         await app.bot.set_my_commands([
-            BotCommand("start", "Start the bot"),
-            BotCommand("login", "Login to access commands"),
-            BotCommand("help", "Show help message"),
-            BotCommand("info", "Get system information (requires login)"),
-            BotCommand("stats", "View statistics (requires login)"),
-            BotCommand("users", "List users (requires login)"),
-            BotCommand("data", "Get data summary (requires login)"),
-            BotCommand("logout", "Logout from bot"),
+            BotCommand(name, description) for name, description, _ in commands
         ])
 
+    async def post_shutdown(app: Application) -> None:
+        bot.close()
+
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
-    # Start the bot
+    # Start the bot (webhook when a public HOST is configured, polling otherwise)
     logger.info("Bot started successfully!")
     print("\n✅ Bot is running...")
     print("Press Ctrl+C to stop\n")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    host = os.getenv('HOST')
+    if host:
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.getenv('PORT', 8443)),
+            url_path=token,
+            webhook_url=f"https://{host}/{token}",
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':